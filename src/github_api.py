@@ -0,0 +1,349 @@
+import os
+import time
+import asyncio
+import threading
+import traceback
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+class GitHubRateLimitError(Exception):
+    """Raised when the GitHub API rate limit is exhausted and the reset is too far away to wait for."""
+
+
+class ResponseCache:
+    """A least-recently-used cache of API responses, where each entry expires after a time-to-live.
+
+    Expired entries are not dropped right away: they keep their ETag so the client
+    can revalidate them with a conditional request (which GitHub answers with 304
+    and does not count against the rate limit). Entries are only removed when the
+    cache is full and they are the least recently used.
+    """
+
+    def __init__(self, max_size=256, ttl=60, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> dict(data, etag, expires)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Get the cache entry for this key, or None if it isn't cached.
+
+        The entry is returned even if it has expired, use is_fresh() to check.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def is_fresh(self, entry):
+        return entry is not None and self.clock() < entry["expires"]
+
+    def put(self, key, data, etag=None):
+        self._entries[key] = dict(data=data, etag=etag, expires=self.clock() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class GitHubClient:
+    """An asyncio client for fetching additional context from the GitHub REST API.
+
+    All requests go through a single aiohttp session, which keeps a pool of
+    keep-alive connections to the API server. Concurrent requests for the same
+    URL are coalesced into one request, and responses are stored in a ResponseCache
+    that is revalidated using ETags once the entries expire.
+
+    The client keeps track of the rate-limit headers and will wait for the limit
+    to reset before sending more requests (or raise a GitHubRateLimitError if the
+    reset is more than max_rate_limit_wait seconds away).
+
+    The client must be used from inside a running event loop, e.g.:
+
+        async with GitHubClient(token=token) as client:
+            role = await client.get_org_role("my-org", "some-user")
+    """
+
+    def __init__(
+        self,
+        token=None,
+        base_url="https://api.github.com",
+        max_connections=10,
+        keepalive_timeout=30,
+        timeout=10,
+        cache_size=256,
+        cache_ttl=60,
+        max_rate_limit_wait=60,
+        secondary_rate_limit_wait=60,
+    ):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.secondary_rate_limit_wait = secondary_rate_limit_wait  # used when GitHub doesn't say how long to wait
+        self.cache = ResponseCache(max_size=cache_size, ttl=cache_ttl)
+
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None  # epoch time (seconds) when the rate limit resets
+
+        self._session = None
+        self._inflight = {}  # url -> task, for coalescing concurrent requests
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """Open the HTTP session (and its connection pool), if it isn't open already."""
+        if self._session is None or self._session.closed:
+            headers = {"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"}
+            if self.token:
+                headers["Authorization"] = f"Bearer {self.token}"
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def get(self, path):
+        """Get the JSON content of an API endpoint.
+
+        Parameters
+        ----------
+        path: str
+            The path of the endpoint, relative to the base_url (e.g., "/orgs/my-org").
+            A full URL is only accepted if it has the same scheme, host and port as the base_url,
+            so the token is never sent anywhere else (e.g., to a URL taken from a forged payload).
+
+        Returns
+        -------
+        data: dict or list
+            The decoded JSON content, or None if the resource doesn't exist (404).
+            If the rate limit doesn't allow a request, an expired cache entry is returned
+            instead, and if there is no such entry a GitHubRateLimitError is raised.
+        """
+        if "://" in path:
+            if self._origin(path) != self._origin(self.base_url):
+                raise ValueError(f"Refusing to send a request to {path}, which is not on {self.base_url}")
+            url = path
+        else:
+            url = f"{self.base_url}/{path.lstrip('/')}"
+
+        entry = self.cache.get(url)
+        if self.cache.is_fresh(entry):
+            return entry["data"]
+
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url, entry))
+            self._inflight[url] = task
+            task.add_done_callback(lambda t: self._inflight.pop(url, None))
+
+        # shield so that one caller being cancelled doesn't cancel the request for the others
+        try:
+            return await asyncio.shield(task)
+        except GitHubRateLimitError:
+            if entry is not None:
+                return entry["data"]  # stale data is better than nothing
+            raise
+
+    @staticmethod
+    def _origin(url):
+        """Get the (scheme, host, port) of a URL, filling in the default port."""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        return scheme, parts.hostname, parts.port or {"http": 80, "https": 443}.get(scheme)
+
+    async def _fetch(self, url, entry=None, retry=True):
+        await self._wait_for_rate_limit()
+        session = await self.open()
+
+        headers = {}
+        if entry is not None and entry["etag"] is not None:
+            headers["If-None-Match"] = entry["etag"]
+
+        async with session.get(url, headers=headers) as response:
+            self._update_rate_limit(response.headers)
+
+            if response.status == 304 and entry is not None:
+                self.cache.put(url, entry["data"], etag=entry["etag"])
+                return entry["data"]
+
+            if response.status in (403, 429) and await self._is_rate_limited(response):
+                if not retry:
+                    raise GitHubRateLimitError(f"Rate limit exceeded when fetching {url}")
+                if "Retry-After" in response.headers:
+                    self.rate_limit_remaining = 0
+                    self.rate_limit_reset = time.time() + float(response.headers["Retry-After"])
+                elif response.headers.get("X-RateLimit-Remaining") != "0":
+                    # a secondary rate limit without Retry-After, github says to wait at least a minute
+                    self.rate_limit_remaining = 0
+                    self.rate_limit_reset = time.time() + self.secondary_rate_limit_wait
+            else:
+                if response.status == 404:
+                    return None
+                response.raise_for_status()
+                data = await response.json()
+                self.cache.put(url, data, etag=response.headers.get("ETag"))
+                return data
+
+        # got rate limited, wait for the reset and try one more time
+        return await self._fetch(url, entry, retry=False)
+
+    def _update_rate_limit(self, headers):
+        if "X-RateLimit-Remaining" in headers:
+            self.rate_limit_remaining = int(headers["X-RateLimit-Remaining"])
+        if "X-RateLimit-Reset" in headers:
+            self.rate_limit_reset = float(headers["X-RateLimit-Reset"])
+
+    @staticmethod
+    async def _is_rate_limited(response):
+        headers = response.headers
+        if response.status == 429 or "Retry-After" in headers or headers.get("X-RateLimit-Remaining") == "0":
+            return True
+        # secondary rate limits can come as a 403 without any rate-limit headers
+        return "secondary rate limit" in (await response.text()).lower()
+
+    async def _wait_for_rate_limit(self):
+        if self.rate_limit_remaining is None or self.rate_limit_remaining > 0 or self.rate_limit_reset is None:
+            return
+
+        wait = self.rate_limit_reset - time.time()
+        if wait > self.max_rate_limit_wait:
+            raise GitHubRateLimitError(f"Rate limit exceeded, resets in {wait:.0f} seconds")
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        self.rate_limit_remaining = None  # unknown until the next response tells us
+
+    async def get_org_role(self, org, username):
+        """Get the role of a user in an organization ("admin" or "member").
+
+        Returns None if the membership was not found. GitHub answers with 404 both when
+        the user is not a member and when the token is not allowed to see the membership
+        (e.g., if it doesn't have the read:org scope), so None means the role is unknown.
+        """
+        membership = await self.get(f"/orgs/{org}/memberships/{username}")
+        if membership is None:
+            return None
+        return membership.get("role")
+
+
+class GitHubEnricher:
+    """Run a GitHubClient on an event loop in a background thread.
+
+    This lets the (synchronous) webhook handler hand off checks that need to
+    fetch more information from GitHub, and return the acknowledgement to GitHub
+    right away instead of waiting for the API calls to finish.
+    """
+
+    def __init__(self, **kwargs):
+        self.client = GitHubClient(**kwargs)
+        self.loop = None
+        self.thread = None
+        self._lock = threading.Lock()  # webhooks can arrive on several threads at once
+
+    @classmethod
+    def from_config(cls, config):
+        """Make an enricher from the "github" section of the configure.yaml file.
+
+        The API token is read from the environment variable named by "token-env".
+        Raises a ValueError if that variable is not set.
+        """
+        config = config or {}
+        token_env = config.get("token-env", "GITHUB_TOKEN")
+        token = os.environ.get(token_env)
+        if not token:
+            raise ValueError(f"GitHub enrichment is enabled, but the {token_env} environment variable is not set")
+
+        return cls(
+            token=token,
+            base_url=config.get("api-url", "https://api.github.com"),
+            max_connections=config.get("max-connections", 10),
+            keepalive_timeout=config.get("keepalive-timeout", 30),
+            timeout=config.get("timeout", 10),
+            cache_size=config.get("cache-size", 256),
+            cache_ttl=config.get("cache-ttl", 60),
+            max_rate_limit_wait=config.get("max-rate-limit-wait", 60),
+            secondary_rate_limit_wait=config.get("secondary-rate-limit-wait", 60),
+        )
+
+    def start(self):
+        """Start the background event loop, if it isn't running already. Returns the loop."""
+        with self._lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="github-enricher", daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def stop(self):
+        """Cancel any pending enrichment, close the client and stop the background event loop.
+
+        The futures returned by submit() for enrichment that didn't finish are cancelled.
+        """
+        with self._lock:
+            if self.thread is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+            self.thread = None
+
+    async def _shutdown(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.client._inflight.clear()
+        await self.client.close()
+
+    def submit(self, func, *args):
+        """Schedule func(client, *args) to run on the background event loop.
+
+        Parameters
+        ----------
+        func: coroutine function
+            Called with the GitHubClient as the first argument, followed by args.
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            Can be used to wait for the result (e.g., in tests), but doesn't need to be.
+            Any errors are printed to the terminal.
+        """
+        loop = self.start()
+        future = asyncio.run_coroutine_threadsafe(func(self.client, *args), loop)
+        future.add_done_callback(self._print_error)
+        return future
+
+    @staticmethod
+    def _print_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            e = future.exception()
+            print(f"Error during enrichment: {''.join(traceback.format_exception(type(e), e, e.__traceback__))}")
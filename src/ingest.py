@@ -1,16 +1,19 @@
 import os
 import yaml
+import asyncio
 import datetime
 
 from models.base import SmartSession, CODE_ROOT
 from models.event import Event, subject_to_int, action_to_int
 from models.report import Report
+from src.github_api import GitHubEnricher
 
 
 # TODO: consider using asyncio or multiprocessing to allow this to run while returning a 200 status code
 #  it is likely that we'd need asyncio because things like fetching past events from DB or getting
 #  content from github are I/O bound operations.
 #  on the other hand, if we need to do some heavy computation, we might want to use multiprocessing/multithreading.
+#  checks that need content from github run on the GitHubEnricher's event loop (see run_enrichment_checks).
 
 
 class WebhookIngester:
@@ -27,11 +30,21 @@ class WebhookIngester:
         self.timestamp = None
         self.event = None
 
+        # checks that need more context from the github API run in the background
+        self.enricher = None
+        if self.config.get("github", {}).get("enrichment", False):
+            self.enricher = GitHubEnricher.from_config(self.config.get("github"))
+        self.enrichment = None  # future of the last enrichment checks that were submitted
+
     def ingest(self, data, headers, timestamp=None):
         """This function processes the incoming webhook data and runs a series of tests on it.
         If any of the tests fail, it will return a report of the failed tests.
         If all the tests pass, it will return None.
 
+        Checks that need to fetch more information from github are submitted
+        to the enricher (if enabled) and do not delay the return of this function.
+        Their reports are added to the database once they are done.
+
         Parameters
         ----------
         data: dict
@@ -78,6 +91,11 @@ class WebhookIngester:
                 session.add(self.event)
                 session.commit()
 
+                if self.enricher is not None:
+                    self.enrichment = self.enricher.submit(
+                        self.run_enrichment_checks, self.event.id, self.data, self.event.subject, self.event.action
+                    )
+
         return report
 
     def create_event(self):
@@ -174,3 +192,70 @@ class WebhookIngester:
         number = self.config.get("repository", {}).get("create-delete-time", 10)
         if self.event.timestamp - created_timestamp < datetime.timedelta(minutes=number):
             self.bad_list.append(f"Repository deleted less than {number} minutes after creation!")
+
+    async def run_enrichment_checks(self, client, event_id, data, subject, action):
+        """Run the checks that need more context from the github API.
+
+        This runs on the enricher's event loop, after the webhook was already acknowledged,
+        so it must not use the attributes of the ingester that are replaced on each call
+        to ingest() (e.g., data, event, bad_list). Everything needed is passed in instead.
+
+        Parameters
+        ----------
+        client: GitHubClient
+            The client used to fetch information from the github API.
+        event_id: int
+            The ID of the Event that was logged for this webhook.
+        data: dict
+            The incoming webhook data.
+        subject: str
+            The subject of the event (e.g., "team").
+        action: str
+            The action of the event (e.g., "created").
+
+        Returns
+        -------
+        report: Report object
+            The report of the failed checks, or None if all checks passed.
+        """
+        # can add more checks here...
+        checks = []
+        if subject == "team" and action == "created":
+            checks.append(self.check_team_creator(client, data))
+
+        # run all the checks concurrently, each one returns a list of bad things
+        bad_list = [bad for results in await asyncio.gather(*checks) for bad in results]
+
+        report = None
+        if len(bad_list) > 0:
+            report = Report(content="; ".join(bad_list), event_id=event_id)
+            await asyncio.to_thread(self.save_report, report)
+            report.printout()
+
+        return report
+
+    @staticmethod
+    def save_report(report):
+        with SmartSession() as session:
+            session.add(report)
+            session.commit()
+
+    async def check_team_creator(self, client, data):
+        """Check who created a new team.
+
+        This check flags teams created by someone who is not an admin of the organization.
+        If the role can't be found (e.g., the token can't see the membership) nothing is flagged.
+        """
+        bad_list = []
+        if self.config.get("team", {}).get("creator-must-be-admin", False):
+            org = data["organization"]["login"]
+            sender = data["sender"]["login"]
+            role = await client.get_org_role(org, sender)
+            if role is None:
+                # github also answers 404 if the token can't see the membership, so don't flag this
+                if self.config.get("verbose", False):
+                    print(f"Could not find the role of '{sender}' in '{org}' (not a member, or token lacks read:org)")
+            elif role != "admin":
+                bad_list.append(f"Team created by '{sender}' who is not an admin of '{org}'")
+
+        return bad_list
@@ -1,3 +1,8 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 
 from src.ingest import WebhookIngester
@@ -6,3 +11,73 @@ from src.ingest import WebhookIngester
 @pytest.fixture
 def ingester():
     return WebhookIngester()
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    """Stand-in for the github API, answering with the routes given to the server.
+
+    Each route maps a path to a dict with the JSON "body", and optionally
+    a "status", an "etag", extra "headers" and a "delay" (seconds).
+    A route can also be a list of such dicts, which are answered in order
+    (the last one is repeated once the others are used up).
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(path=self.path, headers=dict(self.headers)))
+
+        route = server.routes.get(self.path)
+        if route is None:
+            self.send_reply(404, {"message": "Not Found"})
+            return
+
+        if isinstance(route, list):
+            route = route.pop(0) if len(route) > 1 else route[0]
+
+        time.sleep(route.get("delay", 0))
+
+        etag = route.get("etag")
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.send_reply(304, None, {"ETag": etag})
+            return
+
+        headers = dict(route.get("headers", {}))
+        if etag is not None:
+            headers["ETag"] = etag
+        self.send_reply(route.get("status", 200), route.get("body"), headers)
+
+    def send_reply(self, status, body, headers=None):
+        content = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass  # keep the test output clean
+
+
+@pytest.fixture
+def github_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHubHandler)
+    server.daemon_threads = True
+    server.routes = {}
+    server.requests = []
+    server.connections = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+
+    server.shutdown()
+    server.server_close()
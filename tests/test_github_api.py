@@ -0,0 +1,278 @@
+import os
+import time
+import json
+import asyncio
+import threading
+import concurrent.futures
+
+import pytest
+import aiohttp
+import sqlalchemy as sa
+
+from models.base import CODE_ROOT, SmartSession
+from models.report import Report
+
+from src.github_api import GitHubClient, GitHubEnricher, GitHubRateLimitError, ResponseCache
+
+data_dir = os.path.join(CODE_ROOT, "data")
+
+
+def test_response_cache():
+    now = [0.0]
+    cache = ResponseCache(max_size=2, ttl=10, clock=lambda: now[0])
+
+    cache.put("a", {"x": 1}, etag='"etag-a"')
+    cache.put("b", {"x": 2})
+    entry = cache.get("a")  # makes "a" the most recently used
+    assert entry["data"] == {"x": 1}
+    assert entry["etag"] == '"etag-a"'
+    assert cache.is_fresh(entry)
+
+    cache.put("c", {"x": 3})  # evicts "b", the least recently used
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert len(cache) == 2
+
+    # expired entries are kept (with their ETag) but are no longer fresh
+    now[0] = 11.0
+    entry = cache.get("a")
+    assert entry is not None
+    assert not cache.is_fresh(entry)
+    assert cache.get("b") is None
+
+
+def test_coalescing_and_keepalive(github_server):
+    github_server.routes["/orgs/my-org"] = dict(body={"login": "my-org"}, delay=0.2)
+    github_server.routes["/orgs/other-org"] = dict(body={"login": "other-org"})
+
+    async def run():
+        async with GitHubClient(base_url=github_server.url) as client:
+            # concurrent lookups of the same resource share one request
+            results = await asyncio.gather(*[client.get("/orgs/my-org") for _ in range(5)])
+            assert all(r == {"login": "my-org"} for r in results)
+            assert len(github_server.requests) == 1
+
+            # fresh responses come from the cache
+            assert await client.get("/orgs/my-org") == {"login": "my-org"}
+            assert len(github_server.requests) == 1
+
+            # sequential requests reuse the same connection
+            assert await client.get("/orgs/other-org") == {"login": "other-org"}
+            assert await client.get(f"{github_server.url}/does/not/exist") is None
+            assert len(github_server.requests) == 3
+
+    asyncio.run(run())
+    assert github_server.connections == 1
+
+
+def test_foreign_url_is_refused(github_server):
+    github_server.routes["/orgs/my-org"] = dict(body={"login": "my-org"})
+    port = github_server.server_address[1]
+
+    async def run():
+        async with GitHubClient(base_url=github_server.url, token="secret") as client:
+            assert await client.get(f"{github_server.url}/orgs/my-org") == {"login": "my-org"}
+
+            for url in [
+                "http://evil.example.com/orgs/my-org",
+                f"https://127.0.0.1:{port}/orgs/my-org",
+                f"http://127.0.0.1:{port + 1}/orgs/my-org",
+                f"http://localhost:{port}/orgs/my-org",
+            ]:
+                with pytest.raises(ValueError, match="Refusing"):
+                    await client.get(url)
+
+            assert len(github_server.requests) == 1
+
+    asyncio.run(run())
+
+
+def test_etag_revalidation(github_server):
+    github_server.routes["/orgs/my-org/memberships/guynir42"] = dict(body={"role": "admin"}, etag='"v1"')
+
+    async def run():
+        async with GitHubClient(base_url=github_server.url, cache_ttl=0) as client:
+            assert await client.get_org_role("my-org", "guynir42") == "admin"
+            assert "If-None-Match" not in github_server.requests[0]["headers"]
+
+            # the entry expired right away, so it is revalidated and the server answers 304
+            assert await client.get_org_role("my-org", "guynir42") == "admin"
+            assert github_server.requests[1]["headers"]["If-None-Match"] == '"v1"'
+
+            # a changed resource gets a new body and ETag
+            github_server.routes["/orgs/my-org/memberships/guynir42"] = dict(body={"role": "member"}, etag='"v2"')
+            assert await client.get_org_role("my-org", "guynir42") == "member"
+            assert len(github_server.requests) == 3
+
+    asyncio.run(run())
+
+
+def test_rate_limit(github_server):
+    reset = str(int(time.time()) + 3600)
+    github_server.routes["/orgs/my-org"] = dict(
+        body={"login": "my-org"}, headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}
+    )
+    github_server.routes["/orgs/limited"] = dict(
+        status=429, body={"message": "slow down"}, headers={"Retry-After": "0"}
+    )
+
+    async def run():
+        async with GitHubClient(base_url=github_server.url, max_rate_limit_wait=60) as client:
+            # retried once after the Retry-After, then gives up
+            with pytest.raises(GitHubRateLimitError):
+                await client.get("/orgs/limited")
+            assert len(github_server.requests) == 2
+
+            assert await client.get("/orgs/my-org") == {"login": "my-org"}
+            assert client.rate_limit_remaining == 0
+
+            # the limit resets in an hour, so don't send any more requests
+            with pytest.raises(GitHubRateLimitError):
+                await client.get("/orgs/other-org")
+            assert len(github_server.requests) == 3
+
+            # an expired entry is served instead of failing
+            client.cache.ttl = 0
+            client.cache.put(f"{github_server.url}/orgs/other-org", {"login": "stale"})
+            assert await client.get("/orgs/other-org") == {"login": "stale"}
+            assert len(github_server.requests) == 3
+
+    asyncio.run(run())
+
+
+def test_primary_rate_limit(github_server):
+    reset = str(int(time.time()) + 2)
+    github_server.routes["/orgs/my-org"] = [
+        dict(
+            status=403,
+            body={"message": "API rate limit exceeded"},
+            headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset},
+        ),
+        dict(body={"login": "my-org"}, headers={"X-RateLimit-Remaining": "4999"}),
+    ]
+
+    async def run():
+        async with GitHubClient(base_url=github_server.url, max_rate_limit_wait=60) as client:
+            # waits for the reset (1-2 seconds away) and then retries
+            t0 = time.perf_counter()
+            assert await client.get("/orgs/my-org") == {"login": "my-org"}
+            assert time.perf_counter() - t0 >= 0.9
+            assert len(github_server.requests) == 2
+            assert client.rate_limit_remaining == 4999
+
+    asyncio.run(run())
+
+
+def test_secondary_rate_limit(github_server):
+    github_server.routes["/orgs/my-org"] = [
+        dict(status=403, body={"message": "You have exceeded a secondary rate limit. Please wait a few minutes."}),
+        dict(body={"login": "my-org"}),
+    ]
+    github_server.routes["/orgs/limited"] = dict(status=429, body={"message": "slow down"})
+    github_server.routes["/orgs/forbidden"] = dict(status=403, body={"message": "Resource not accessible"})
+
+    async def run():
+        async with GitHubClient(base_url=github_server.url, secondary_rate_limit_wait=1) as client:
+            # no Retry-After, so wait the fallback time and retry
+            t0 = time.perf_counter()
+            assert await client.get("/orgs/my-org") == {"login": "my-org"}
+            assert time.perf_counter() - t0 >= 0.9
+            assert len(github_server.requests) == 2
+
+            # any other 403 is just an error
+            with pytest.raises(aiohttp.ClientResponseError):
+                await client.get("/orgs/forbidden")
+            assert len(github_server.requests) == 3
+
+        # the fallback wait is still capped by max_rate_limit_wait
+        async with GitHubClient(base_url=github_server.url, max_rate_limit_wait=10) as client:
+            with pytest.raises(GitHubRateLimitError):
+                await client.get("/orgs/limited")
+            assert len(github_server.requests) == 4
+
+    asyncio.run(run())
+
+
+def test_enrichment_does_not_block_ingest(ingester, github_server):
+    with open(os.path.join(data_dir, "example_new_team.json")) as f:
+        json_data = json.load(f)
+
+    github_server.routes["/orgs/legit-organization-name/memberships/guynir42"] = dict(body={"role": "member"}, delay=2)
+    ingester.config.setdefault("team", {})["creator-must-be-admin"] = True
+    ingester.enricher = GitHubEnricher(base_url=github_server.url)
+
+    try:
+        ret = ingester.ingest(json_data, {"X-GitHub-Event": "team"})
+        assert not ingester.enrichment.done()  # does not wait for the github API
+        assert ret is None
+
+        report = ingester.enrichment.result(timeout=5)
+        assert isinstance(report, Report)
+        assert report.content == "Team created by 'guynir42' who is not an admin of 'legit-organization-name'"
+        assert report.event_id == ingester.event.id
+
+        with SmartSession() as session:
+            report = session.scalars(sa.select(Report).where(Report.id == report.id)).first()
+        assert report is not None
+        assert report.event_id == ingester.event.id
+
+        # an admin creating a team is fine (the old response is still cached, so clear it)
+        github_server.routes["/orgs/legit-organization-name/memberships/guynir42"] = dict(body={"role": "admin"})
+        ingester.enricher.client.cache.clear()
+        ingester.ingest(json_data, {"X-GitHub-Event": "team"})
+        assert ingester.enrichment.result(timeout=5) is None
+
+        # an unknown role (404, e.g., the token can't see the membership) is not flagged
+        del github_server.routes["/orgs/legit-organization-name/memberships/guynir42"]
+        ingester.enricher.client.cache.clear()
+        ingester.ingest(json_data, {"X-GitHub-Event": "team"})
+        assert ingester.enrichment.result(timeout=5) is None
+    finally:
+        ingester.enricher.stop()
+
+
+def test_enricher_starts_one_loop():
+    enricher = GitHubEnricher()
+    barrier = threading.Barrier(8)
+
+    def start():
+        barrier.wait()
+        return enricher.start()
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            loops = list(pool.map(lambda _: start(), range(8)))
+        assert all(loop is loops[0] for loop in loops)
+        assert [t.name for t in threading.enumerate()].count("github-enricher") == 1
+    finally:
+        enricher.stop()
+
+    assert "github-enricher" not in [t.name for t in threading.enumerate()]
+
+
+def test_enricher_requires_token(monkeypatch):
+    monkeypatch.delenv("GITHUB_TOKEN", raising=False)
+    with pytest.raises(ValueError, match="GITHUB_TOKEN"):
+        GitHubEnricher.from_config({"enrichment": True})
+
+    monkeypatch.setenv("GITHUB_TOKEN", "secret")
+    enricher = GitHubEnricher.from_config({"enrichment": True})
+    assert enricher.client.token == "secret"
+
+
+def test_enricher_stop_cancels_pending(github_server):
+    github_server.routes["/orgs/my-org"] = dict(body={"login": "my-org"}, delay=1)
+    enricher = GitHubEnricher(base_url=github_server.url)
+
+    async def fetch(client):
+        return await client.get("/orgs/my-org")
+
+    future = enricher.submit(fetch)
+    while len(github_server.requests) == 0:  # wait for the request to be in flight
+        time.sleep(0.01)
+    enricher.stop()
+
+    with pytest.raises(concurrent.futures.CancelledError):
+        future.result(timeout=2)
+    assert enricher.client._inflight == {}